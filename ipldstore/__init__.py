@@ -3,7 +3,7 @@ IPLD stores for zarr
 """
 
 from .ipldstore import IPLDStore
-from .contentstore import ContentAddressableStore, MappingCAStore, IPFSStore
+from .contentstore import ContentAddressableStore, MappingCAStore, IPFSStore, TieredCAStore
 
 def get_ipfs_mapper(host : str = "http://127.0.0.1:5001") -> IPLDStore:
     """
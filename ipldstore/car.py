@@ -33,6 +33,22 @@ class CARBlockLocation:
         return self.varint_size + self.cid_size + self.payload_size
 
 
+def encode_car_header(roots: List[CID]) -> bytes:
+    """
+    Encodes a CAR (v1) header for the given roots.
+    """
+    header = dag_cbor.encode({"version": 1, "roots": roots})
+    return varint.encode(len(header)) + header
+
+
+def encode_car_block(cid: CID, data: bytes) -> bytes:
+    """
+    Encodes a single CAR block.
+    """
+    cid_bytes = bytes(cid)
+    return varint.encode(len(cid_bytes) + len(data)) + cid_bytes + data
+
+
 def decode_car_header(stream: BinaryIO) -> Tuple[List[CID], int]:
     """
     Decodes a CAR header and returns the list of contained roots.
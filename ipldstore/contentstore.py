@@ -1,16 +1,23 @@
 from abc import ABC, abstractmethod
-from typing import MutableMapping, Optional, Union, overload, Iterator, MutableSet, List
+from typing import Callable, MutableMapping, Optional, Union, overload, Iterator, MutableSet, List, Iterable, Set, TYPE_CHECKING
+import json
+import uuid
+import base64
+from collections import OrderedDict
 from io import BufferedIOBase, BytesIO
+import queue
+import threading
 
-from multiformats import CID, multicodec, multibase, multihash, varint
+from multiformats import CID, multicodec, multibase, multihash
 import dag_cbor
 from dag_cbor.encoding import EncodableType as DagCborEncodable
 from typing_validation import validate
 
-import requests
+from .car import read_car, decode_car_header, encode_car_header, encode_car_block
+from .utils import StreamLike, ensure_stream, chunks_to_stream
 
-from .car import read_car
-from .utils import StreamLike
+if TYPE_CHECKING:
+    import requests
 
 
 ValueType = Union[bytes, DagCborEncodable]
@@ -20,6 +27,9 @@ DagCborCodec = multicodec.get("dag-cbor")
 
 
 class ContentAddressableStore(ABC):
+    # trusted stores skip per-call type validation on their hot paths
+    _trusted: bool = False
+
     @abstractmethod
     def get_raw(self, cid: CID) -> bytes:
         ...
@@ -48,7 +58,8 @@ class ContentAddressableStore(ABC):
         ...
 
     def put(self, value: ValueType) -> CID:
-        validate(value, ValueType)
+        if not self._trusted:
+            validate(value, ValueType)
         if isinstance(value, bytes):
             return self.put_raw(value, RawCodec)
         else:
@@ -57,16 +68,47 @@ class ContentAddressableStore(ABC):
     def normalize_cid(self, cid: CID) -> CID:  # pylint: disable=no-self-use
         return cid
 
+    def flush(self, root: Optional[CID] = None) -> None:
+        """
+            Waits until all previously put blocks are stored durably.
+
+            If ``root`` is given, all blocks reachable from it must be stored
+            durably as well, even if they haven't been put through this store.
+        """
+
     @overload
-    def to_car(self, root: CID, stream: BufferedIOBase) -> int:
+    def to_car(self,
+               root: CID,
+               stream: BufferedIOBase,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> int:
         ...
 
     @overload
-    def to_car(self, root: CID, stream: None = None) -> bytes:
+    def to_car(self,
+               root: CID,
+               stream: None = None,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> bytes:
         ...
 
-    def to_car(self, root: CID, stream: Optional[BufferedIOBase] = None) -> Union[bytes, int]:
-        validate(root, CID)
+    def to_car(self,
+               root: CID,
+               stream: Optional[BufferedIOBase] = None,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> Union[bytes, int]:
+        """
+            Writes all blocks reachable from ``root`` as CAR.
+
+            If ``base_roots`` or ``known_cids`` are given, a delta CAR is
+            written, which only contains blocks not reachable from any of the
+            ``base_roots``. Each of the ``known_cids`` is assumed to be
+            available to the receiver including everything it links to, so
+            traversal stops at those blocks as well.
+        """
         validate(stream, Optional[BufferedIOBase])
 
         if stream is None:
@@ -77,38 +119,69 @@ class ContentAddressableStore(ABC):
             return_bytes = False
 
         bytes_written = 0
-        header = dag_cbor.encode({"version": 1, "roots": [root]})
-        bytes_written += stream.write(varint.encode(len(header)))
-        bytes_written += stream.write(header)
-        bytes_written += self._to_car(root, stream, set())
+        for chunk in self.iter_car(root, base_roots=base_roots, known_cids=known_cids):
+            bytes_written += stream.write(chunk)
 
         if return_bytes:
             return buffer.getvalue()
         else:
             return bytes_written
 
-    def _to_car(self,
-                root: CID,
-                stream: BufferedIOBase,
-                already_written: MutableSet[CID]) -> int:
+    def iter_car(self,
+                 root: CID,
+                 *,
+                 base_roots: Iterable[CID] = (),
+                 known_cids: Iterable[CID] = ()) -> Iterator[bytes]:
         """
-            makes a CAR without the header
+            Generates the CAR written by ``to_car`` as a sequence of byte chunks.
         """
-        bytes_written = 0
+        validate(root, CID)
+        base_roots = list(base_roots)
+        known_cids = list(known_cids)
+        validate(base_roots, List[CID])
+        validate(known_cids, List[CID])
 
+        already_written = set(known_cids)
+        self._mark_reachable(base_roots, already_written)
+
+        yield encode_car_header([root])
+        yield from self._iter_car_blocks(root, already_written)
+
+    def _iter_car_blocks(self,
+                         root: CID,
+                         already_written: MutableSet[CID]) -> Iterator[bytes]:
+        """
+            makes a CAR without the header
+        """
         if root not in already_written:
             data = self.get_raw(root)
-            cid_bytes = bytes(root)
-            bytes_written += stream.write(varint.encode(len(cid_bytes) + len(data)))
-            bytes_written += stream.write(cid_bytes)
-            bytes_written += stream.write(data)
+            yield encode_car_block(root, data)
             already_written.add(root)
 
             if root.codec == DagCborCodec:
                 value = dag_cbor.decode(data)
                 for child in iter_links(value):
-                    bytes_written += self._to_car(child, stream, already_written)
-        return bytes_written
+                    yield from self._iter_car_blocks(child, already_written)
+
+    def _mark_reachable(self,
+                        roots: Iterable[CID],
+                        marked: MutableSet[CID]) -> None:
+        """
+            adds all CIDs reachable from roots to marked
+
+            CIDs which are already marked are assumed to be complete, so
+            traversal doesn't descend into them. Only dag-cbor blocks have to
+            be fetched, raw blocks can't contain links.
+        """
+        stack = [root for root in roots if root not in marked]
+        while stack:
+            cid = stack.pop()
+            if cid in marked:
+                continue
+            marked.add(cid)
+            if cid.codec == DagCborCodec:
+                value = dag_cbor.decode(self.get_raw(cid))
+                stack.extend(child for child in iter_links(value) if child not in marked)
 
     def import_car(self, stream_or_bytes: StreamLike) -> List[CID]:
         roots, blocks = read_car(stream_or_bytes)
@@ -125,16 +198,25 @@ class MappingCAStore(ContentAddressableStore):
                  mapping: Optional[MutableMapping[str, bytes]] = None,
                  default_hash: Union[str, int, multicodec.Multicodec, multihash.Multihash] = "sha2-256",
                  default_base: Union[str, multibase.Multibase] = "base32",
+                 trusted: bool = False,
                  ):
         validate(mapping, Optional[MutableMapping[str, bytes]])
         validate(default_hash, Union[str, int, multicodec.Multicodec, multihash.Multihash])
         validate(default_base, Union[str, multibase.Multibase])
+        validate(trusted, bool)
+
+        self._trusted = trusted
 
         if mapping is not None:
             self._mapping = mapping
         else:
             self._mapping = {}
 
+        # state of a running garbage collection: keys written and CIDs which
+        # still have to be marked
+        self._gc_written: Optional[Set[str]] = None
+        self._gc_stack: List[CID] = []
+
         if isinstance(default_hash, multihash.Multihash):
             self._default_hash = default_hash
         else:
@@ -146,57 +228,181 @@ class MappingCAStore(ContentAddressableStore):
             self._default_base = multibase.get(default_base)
 
     def normalize_cid(self, cid: CID) -> CID:
+        if cid.version == 1 and cid.base == self._default_base:
+            return cid
         return cid.set(base=self._default_base, version=1)
 
+    def _key(self, cid: CID) -> str:
+        """
+            mapping key of a CID, equal to ``str(self.normalize_cid(cid))``
+        """
+        if cid.version == 1 and self._default_base.name == "base32":
+            # multiformats' generic multibase encoder dominates the cost of
+            # small block accesses, base32 is much faster to do by hand
+            return "b" + base64.b32encode(bytes(cid)).decode("ascii").lower().rstrip("=")
+        return str(self.normalize_cid(cid))
+
     def get_raw(self, cid: CID) -> bytes:
-        validate(cid, CID)
-        return self._mapping[str(self.normalize_cid(cid))]
+        if not self._trusted:
+            validate(cid, CID)
+        return self._mapping[self._key(cid)]
 
     def put_raw(self,
                 raw_value: bytes,
                 codec: Union[str, int, multicodec.Multicodec]) -> CID:
-        validate(raw_value, bytes)
-        validate(codec, Union[str, int, multicodec.Multicodec])
+        if not self._trusted:
+            validate(raw_value, bytes)
+            validate(codec, Union[str, int, multicodec.Multicodec])
 
         h = self._default_hash.digest(raw_value)
         cid = CID(self._default_base, 1, codec, h)
-        self._mapping[str(cid)] = raw_value
+        key = self._key(cid)
+        self._mapping[key] = raw_value
+        if self._gc_written is not None:
+            # write barrier: the new block is kept and everything it links to
+            # is marked before sweeping continues
+            self._gc_written.add(key)
+            if cid.codec == DagCborCodec:
+                self._gc_stack.extend(iter_links(dag_cbor.decode(raw_value)))
         return cid
 
+    def collect_garbage(self, live_roots: Iterable[CID]) -> int:
+        """
+            Deletes all blocks which are not reachable from any of the live roots.
+
+            Returns the number of reclaimed bytes.
+        """
+        reclaimed = 0
+        for reclaimed in self.iter_collect_garbage(live_roots):
+            pass
+        return reclaimed
+
+    def iter_collect_garbage(self, live_roots: Iterable[CID], batch_size: int = 1000) -> Iterator[int]:
+        """
+            Incremental mark-and-sweep garbage collection.
+
+            Each step of the returned iterator marks or sweeps at most
+            ``batch_size`` blocks and yields the number of bytes reclaimed so
+            far, so that the collection can be interleaved with other work.
+            Blocks which are written while the collection is running are
+            retained.
+        """
+        live_roots = list(live_roots)
+        validate(live_roots, List[CID])
+        validate(batch_size, int)
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if self._gc_written is not None:
+            raise RuntimeError("garbage collection is already running")
+
+        self._gc_written = set()
+        self._gc_stack = list(live_roots)
+        steps = self._iter_collect_garbage(batch_size)
+        # enter the generator, so that its cleanup also runs if it's never iterated
+        next(steps)
+        return steps
+
+    def _iter_collect_garbage(self, batch_size: int) -> Iterator[int]:
+        assert self._gc_written is not None
+        try:
+            yield 0
+
+            candidates = list(self._mapping)
+            marked: Set[str] = set()
+            reclaimed = 0
+
+            while self._gc_stack:
+                self._gc_mark(marked, batch_size)
+                yield reclaimed
+
+            for start in range(0, len(candidates), batch_size):
+                # blocks written since the last step may link to unmarked blocks
+                while self._gc_stack:
+                    self._gc_mark(marked, len(self._gc_stack))
+                for key in candidates[start:start + batch_size]:
+                    if key in marked or key in self._gc_written:
+                        continue
+                    try:
+                        reclaimed += len(self._mapping.pop(key))
+                    except KeyError:
+                        pass
+                yield reclaimed
+        finally:
+            self._gc_written = None
+            self._gc_stack = []
+
+    def _gc_mark(self, marked: Set[str], count: int) -> None:
+        for _ in range(min(count, len(self._gc_stack))):
+            cid = self._gc_stack.pop()
+            key = self._key(cid)
+            if key in marked:
+                continue
+            try:
+                data = self._mapping[key]
+            except KeyError:
+                raise ValueError(f"live block '{cid}' is missing from the store, "
+                                 "refusing to collect garbage") from None
+            marked.add(key)
+            if cid.codec == DagCborCodec:
+                self._gc_stack.extend(iter_links(dag_cbor.decode(data)))
+            elif cid.codec != RawCodec:
+                # the block might link to others which we can't find,
+                # so sweeping could delete live data
+                raise ValueError(f"can't follow links of codec '{cid.codec.name}', "
+                                 "refusing to collect garbage")
+
 
 class IPFSStore(ContentAddressableStore):
     def __init__(self,
                  host: str,
                  default_hash: Union[str, int, multicodec.Multicodec, multihash.Multihash] = "sha2-256",
+                 trusted: bool = False,
                  ):
         validate(host, str)
         validate(default_hash, Union[str, int, multicodec.Multicodec, multihash.Multihash])
+        validate(trusted, bool)
 
+        # requests is only imported once an IPFSStore is created, which keeps `import ipldstore` light
+        import requests  # pylint: disable=import-outside-toplevel,redefined-outer-name
         self._host = host
+        self._trusted = trusted
+        # requests.Session isn't documented to be thread-safe, but an
+        # IPFSStore may be used from multiple threads (e.g. by a TieredCAStore)
+        self._new_session: Callable[[], "requests.Session"] = requests.Session
+        self._sessions = threading.local()
 
         if isinstance(default_hash, multihash.Multihash):
             self._default_hash = default_hash
         else:
             self._default_hash = multihash.Multihash(codec=default_hash)
 
+    @property
+    def _session(self) -> "requests.Session":
+        session: Optional["requests.Session"] = getattr(self._sessions, "session", None)
+        if session is None:
+            session = self._sessions.session = self._new_session()
+        return session
+
     def get_raw(self, cid: CID) -> bytes:
-        validate(cid, CID)
-        res = requests.post(self._host + "/api/v0/block/get", params={"arg": str(cid)})
+        if not self._trusted:
+            validate(cid, CID)
+        res = self._session.post(self._host + "/api/v0/block/get", params={"arg": str(cid)})
         res.raise_for_status()
         return res.content
 
     def put_raw(self,
                 raw_value: bytes,
                 codec: Union[str, int, multicodec.Multicodec]) -> CID:
-        validate(raw_value, bytes)
-        validate(codec, Union[str, int, multicodec.Multicodec])
+        if not self._trusted:
+            validate(raw_value, bytes)
+            validate(codec, Union[str, int, multicodec.Multicodec])
 
         if isinstance(codec, str):
             codec = multicodec.get(name=codec)
         elif isinstance(codec, int):
             codec = multicodec.get(code=codec)
 
-        res = requests.post(self._host + "/api/v0/dag/put",
+        res = self._session.post(self._host + "/api/v0/dag/put",
                             params={"store-codec": codec.name,
                                     "input-codec": codec.name,
                                     "hash": self._default_hash.name},
@@ -204,6 +410,252 @@ class IPFSStore(ContentAddressableStore):
         res.raise_for_status()
         return CID.decode(res.json()["Cid"]["/"])
 
+    def import_car(self,
+                   stream_or_bytes: Union[StreamLike, Iterable[bytes]],
+                   chunk_size: int = 2**20) -> List[CID]:
+        """
+            Imports a CAR using a single streaming ``dag/import`` request.
+
+            Besides a stream or bytes, this also accepts an iterable of byte
+            chunks, e.g. ``local_store.iter_car(root)``, so that a local store
+            can be pushed without buffering the whole CAR in memory.
+        """
+        validate(chunk_size, int)
+        if isinstance(stream_or_bytes, bytes) or hasattr(stream_or_bytes, "read"):
+            stream = ensure_stream(stream_or_bytes)  # type: ignore [arg-type]
+        else:
+            stream = chunks_to_stream(stream_or_bytes)
+
+        roots, _ = decode_car_header(stream)
+        header = encode_car_header(roots)
+        boundary = uuid.uuid4().hex
+
+        def body() -> Iterator[bytes]:
+            yield (f"--{boundary}\r\n"
+                   "Content-Disposition: form-data; name=\"file\"; filename=\"import.car\"\r\n"
+                   "Content-Type: application/octet-stream\r\n\r\n").encode("ascii")
+            yield header
+            while chunk := stream.read(chunk_size):
+                yield chunk
+            yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+        res = self._session.post(self._host + "/api/v0/dag/import",
+                            params={"pin-roots": "false"},
+                            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                            data=body())
+        res.raise_for_status()
+        # dag/import streams one JSON object per line, errors which occur
+        # after the response has started are reported inline
+        for line in res.iter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.get("Type") == "error":
+                raise ValueError(f"IPFS node failed to import CAR: {message.get('Message')}")
+            if message.get("Root", {}).get("PinErrorMsg"):
+                raise ValueError(f"IPFS node failed to pin root: {message['Root']['PinErrorMsg']}")
+        return [self.normalize_cid(root) for root in roots]
+
+
+class TieredCAStore(ContentAddressableStore):
+    """
+    Write-back store with a fast local tier in front of a (slow) remote store.
+
+    Blocks are written to the local tier and their CIDs are returned
+    immediately. A background thread uploads them to the remote store in
+    batches, each batch as a single ``import_car`` call. At most
+    ``max_queue_size`` blocks may be pending, further writes block until the
+    flusher catches up. Reads fall through from the local to the remote tier.
+
+    The CIDs of the most recent ``durable_cache_size`` uploaded blocks are
+    remembered, so that they aren't uploaded again. ``flush(root)`` (used by
+    ``freeze(flush=True)``) additionally walks the local tier from ``root`` and
+    uploads every reachable block not known to be durable, which covers blocks
+    already present in a persistent local tier. Blocks reachable from ``root``
+    which aren't in the local tier are assumed to be in the remote already.
+
+    The flusher is a daemon thread, so blocks which are still pending when
+    the process exits are lost. Call ``flush()`` (or ``freeze(flush=True)`` on
+    an ``IPLDStore``) to wait for uploads and ``close()`` to stop the flusher,
+    or use the store as a context manager. Failed uploads are retried on the
+    next ``flush()``, which raises as long as any block could not be uploaded.
+    """
+    def __init__(self,
+                 local: ContentAddressableStore,
+                 remote: ContentAddressableStore,
+                 max_queue_size: int = 1000,
+                 batch_size: int = 100,
+                 trusted: bool = False,
+                 durable_cache_size: int = 100000,
+                 ):
+        validate(local, ContentAddressableStore)
+        validate(remote, ContentAddressableStore)
+        validate(max_queue_size, int)
+        validate(batch_size, int)
+        validate(trusted, bool)
+        validate(durable_cache_size, int)
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size must be positive")
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if durable_cache_size < 0:
+            raise ValueError("durable_cache_size must not be negative")
+
+        self._local = local
+        self._remote = remote
+        self._trusted = trusted
+        self._batch_size = batch_size
+        self._durable_cache_size = durable_cache_size
+        self._queue: "queue.Queue[Optional[CID]]" = queue.Queue(max_queue_size)
+        # all of the following are protected by _lock
+        self._lock = threading.Lock()
+        self._pending: Set[CID] = set()
+        self._failed: Set[CID] = set()
+        self._durable: "OrderedDict[CID, None]" = OrderedDict()
+        self._error: Optional[BaseException] = None
+        self._flusher: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "TieredCAStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def normalize_cid(self, cid: CID) -> CID:
+        return self._local.normalize_cid(cid)
+
+    def get_raw(self, cid: CID) -> bytes:
+        if not self._trusted:
+            validate(cid, CID)
+        try:
+            return self._local.get_raw(cid)
+        except KeyError:
+            return self._remote.get_raw(cid)
+
+    def put_raw(self,
+                raw_value: bytes,
+                codec: Union[str, int, multicodec.Multicodec]) -> CID:
+        if not self._trusted:
+            validate(raw_value, bytes)
+            validate(codec, Union[str, int, multicodec.Multicodec])
+
+        cid = self._local.put_raw(raw_value, codec)
+        with self._lock:
+            if cid in self._pending:
+                return cid
+            if cid in self._durable:
+                self._durable.move_to_end(cid)
+                return cid
+            self._failed.discard(cid)
+            self._pending.add(cid)
+            self._ensure_flusher()
+        self._queue.put(cid)
+        return cid
+
+    def flush(self, root: Optional[CID] = None) -> None:
+        reachable = [] if root is None else self._local_reachable(root)
+        with self._lock:
+            retry = set(self._failed)
+            self._failed.clear()
+            retry.update(cid for cid in reachable
+                         if cid not in self._pending and cid not in self._durable)
+            self._pending.update(retry)
+            if retry:
+                self._ensure_flusher()
+        for cid in retry:
+            self._queue.put(cid)
+
+        self._queue.join()
+
+        with self._lock:
+            if self._failed:
+                raise RuntimeError(f"{len(self._failed)} blocks could not be written to remote store") \
+                    from self._error
+            self._error = None
+
+    def close(self) -> None:
+        """
+            Flushes all pending blocks and stops the background flusher.
+        """
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                flusher, self._flusher = self._flusher, None
+            if flusher is not None:
+                self._queue.put(None)
+                flusher.join()
+
+    def _local_reachable(self, root: CID) -> List[CID]:
+        reachable: List[CID] = []
+        seen = set()
+        stack = [root]
+        while stack:
+            cid = stack.pop()
+            if cid in seen:
+                continue
+            seen.add(cid)
+            try:
+                data = self._local.get_raw(cid)
+            except KeyError:
+                continue
+            reachable.append(cid)
+            if cid.codec == DagCborCodec:
+                stack.extend(iter_links(dag_cbor.decode(data)))
+        return reachable
+
+    def _ensure_flusher(self) -> None:
+        # must be called with _lock held
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                cids = [cid for cid in batch if cid is not None]
+                if cids:
+                    self._flush_batch(cids)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if None in batch:
+                return
+
+    def _flush_batch(self, batch: List[CID]) -> None:
+        try:
+            if type(self._remote).import_car is not ContentAddressableStore.import_car:
+                # the remote has a bulk import (e.g. dag/import on IPFS), which
+                # stores blocks under the CIDs given in the CAR
+                car = encode_car_header(batch) + b"".join(encode_car_block(cid, self._local.get_raw(cid))
+                                                          for cid in batch)
+                self._remote.import_car(car)
+            else:
+                for cid in batch:
+                    stored_cid = self._remote.put_raw(self._local.get_raw(cid), cid.codec)
+                    if stored_cid.digest != cid.digest:
+                        raise ValueError(f"remote store returned '{stored_cid}' for block '{cid}', "
+                                         "it likely uses a different hash function")
+        except Exception as e:  # pylint: disable=broad-except
+            with self._lock:
+                self._error = e
+                self._failed.update(batch)
+                self._pending.difference_update(batch)
+        else:
+            with self._lock:
+                for cid in batch:
+                    self._durable[cid] = None
+                    self._durable.move_to_end(cid)
+                while len(self._durable) > self._durable_cache_size:
+                    self._durable.popitem(last=False)
+                self._pending.difference_update(batch)
+
 
 def iter_links(o: DagCborEncodable) -> Iterator[CID]:
     if isinstance(o, dict):
@@ -216,4 +668,4 @@ def iter_links(o: DagCborEncodable) -> Iterator[CID]:
         yield o
 
 
-__all__ = ["ContentAddressableStore", "MappingCAStore", "iter_links"]
+__all__ = ["ContentAddressableStore", "MappingCAStore", "TieredCAStore", "iter_links"]
@@ -6,14 +6,14 @@ from io import BufferedIOBase
 from collections.abc import MutableMapping
 import sys
 from dataclasses import dataclass
-from typing import Optional, Callable, Any, TypeVar, Union, Iterator, overload, List, Dict
+from typing import Optional, Callable, Any, TypeVar, Union, Iterator, Iterable, overload, List, Dict
 import json
 
 from multiformats import CID
 import dag_cbor
 from numcodecs.compat import ensure_bytes  # type: ignore
 
-from .contentstore import ContentAddressableStore, MappingCAStore
+from .contentstore import ContentAddressableStore, MappingCAStore, RawCodec, DagCborCodec
 from .utils import StreamLike
 
 if sys.version_info >= (3, 9):
@@ -70,7 +70,8 @@ class IPLDStore(MutableMappingSB):
         try:
             inline_codec = inline_objects[key_parts[-1]]
         except KeyError:
-            cid = self._store.put(value)
+            # ensure_bytes already checked the value, so skip validation in put
+            cid = self._store.put_raw(value, RawCodec)
             set_value = cid
         else:
             set_value = inline_codec.decoder(value)
@@ -98,12 +99,20 @@ class IPLDStore(MutableMappingSB):
     def __len__(self) -> int:
         return len(list(iter(self)))
 
-    def freeze(self) -> CID:
+    def freeze(self, flush: bool = False) -> CID:
         """
             Store current version and return the corresponding root cid.
+
+            If ``flush`` is set, wait until all blocks reachable from the root
+            are durably stored by the underlying store (e.g. uploaded by a
+            ``TieredCAStore``).
         """
         if self.root_cid is None:
-            self.root_cid = self._store.put(self._mapping)
+            # dag_cbor.encode rejects anything which is not encodable, so
+            # there's no need to validate the whole tree upfront
+            self.root_cid = self._store.put_raw(dag_cbor.encode(self._mapping), DagCborCodec)
+        if flush:
+            self._store.flush(self.root_cid)
         return self.root_cid
 
     def clear(self) -> None:
@@ -111,15 +120,43 @@ class IPLDStore(MutableMappingSB):
         self._mapping = {}
 
     @overload
-    def to_car(self, stream: BufferedIOBase) -> int:
+    def to_car(self,
+               stream: BufferedIOBase,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> int:
         ...
 
     @overload
-    def to_car(self, stream: None = None) -> bytes:
+    def to_car(self,
+               stream: None = None,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> bytes:
         ...
 
-    def to_car(self, stream: Optional[BufferedIOBase] = None) -> Union[int, bytes]:
-        return self._store.to_car(self.freeze(), stream)
+    def to_car(self,
+               stream: Optional[BufferedIOBase] = None,
+               *,
+               base_roots: Iterable[CID] = (),
+               known_cids: Iterable[CID] = ()) -> Union[int, bytes]:
+        """
+            Export the current version as CAR.
+
+            Blocks reachable from any of ``base_roots`` (e.g. previously
+            published versions) or from ``known_cids`` are left out.
+        """
+        return self._store.to_car(self.freeze(), stream, base_roots=base_roots, known_cids=known_cids)
+
+    def iter_car(self,
+                 *,
+                 base_roots: Iterable[CID] = (),
+                 known_cids: Iterable[CID] = ()) -> Iterator[bytes]:
+        """
+            Generates the CAR of ``to_car`` in chunks, e.g. to stream it into
+            ``IPFSStore.import_car`` without buffering it.
+        """
+        return self._store.iter_car(self.freeze(), base_roots=base_roots, known_cids=known_cids)
 
     def import_car(self, stream: StreamLike) -> None:
         roots = self._store.import_car(stream)
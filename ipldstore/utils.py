@@ -2,8 +2,8 @@
 Some utilities.
 """
 
-from io import BytesIO
-from typing import List, Union, BinaryIO
+from io import BytesIO, RawIOBase, BufferedReader
+from typing import List, Union, BinaryIO, Iterable, Iterator, Optional, cast
 
 from multiformats import CID
 from typing_extensions import TypeGuard
@@ -17,5 +17,32 @@ def ensure_stream(stream_or_bytes: StreamLike) -> BinaryIO:
         return stream_or_bytes
 
 
+class _ChunkStream(RawIOBase):
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._current: Optional[memoryview] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "memoryview") -> int:  # type: ignore [override]
+        while not self._current:
+            try:
+                self._current = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+
+def chunks_to_stream(chunks: Iterable[bytes]) -> BinaryIO:
+    """
+    Wraps an iterable of byte chunks (e.g. from ``iter_car``) into a readable stream.
+    """
+    return cast(BinaryIO, BufferedReader(_ChunkStream(chunks)))
+
+
 def is_cid_list(os: List[object]) -> TypeGuard[List[CID]]:
     return all(isinstance(o, CID) for o in os)
@@ -1,5 +1,8 @@
 from ipldstore.contentstore import MappingCAStore
-from multiformats import CID
+from ipldstore.car import read_car
+from multiformats import CID, varint
+import dag_cbor
+import hashlib
 
 import pytest
 
@@ -43,3 +46,150 @@ def test_car_roundtrip(values):
     assert s2.get(root) == all_cids
     for cid, value in keyed_values:
         assert s2.get(cid) == value
+
+
+def test_delta_car():
+    s = MappingCAStore()
+    a = s.put(b"a")
+    b = s.put(b"b")
+    c = s.put(b"c")
+    shared = s.put({"a": a, "b": b})
+    base = s.put({"shared": shared})
+    new = s.put({"shared": shared, "c": c})
+
+    s2 = MappingCAStore()
+    s2.import_car(s.to_car(base))
+    delta = s.to_car(new, base_roots=[base])
+    roots, blocks = read_car(delta)
+    assert roots == [new]
+    assert {cid for cid, _, _ in blocks} == {new, c}
+    s2.import_car(delta)
+    assert s2.get(new) == {"shared": shared, "c": c}
+    assert s2.get(c) == b"c"
+
+
+def test_delta_car_known_cids():
+    s = MappingCAStore()
+    a = s.put(b"a")
+    b = s.put(b"b")
+    root = s.put([a, b])
+
+    s2 = MappingCAStore()
+    s2.import_car(s.to_car(root, known_cids=[a]))
+    assert a not in s2
+    assert s2.get(b) == b"b"
+    assert s2.get(root) == [a, b]
+
+
+def test_collect_garbage():
+    s = MappingCAStore()
+    a = s.put(b"a")
+    old_b = s.put(b"old b")
+    new_b = s.put(b"new b")
+    old_root = s.put({"a": a, "b": old_b})
+    new_root = s.put({"a": a, "b": new_b})
+
+    expected = len(s.get_raw(old_root)) + len(b"old b")
+
+    assert s.collect_garbage([new_root]) == expected
+    assert old_root not in s
+    assert old_b not in s
+    assert s.get(new_root) == {"a": a, "b": new_b}
+    assert s.get(a) == b"a"
+    assert s.get(new_b) == b"new b"
+
+
+def test_collect_garbage_keeps_concurrent_writes():
+    s = MappingCAStore()
+    garbage = s.put(b"garbage")
+    root = s.put([s.put(b"live")])
+
+    steps = s.iter_collect_garbage([root], batch_size=1)
+    next(steps)
+    assert s.put(b"garbage") == garbage
+    late = s.put(b"late")
+    for _ in steps:
+        pass
+    assert s.get(garbage) == b"garbage"
+    assert s.get(late) == b"late"
+
+
+def test_put_validates_values():
+    s = MappingCAStore()
+    with pytest.raises(TypeError):
+        s.put(object())
+
+
+@pytest.mark.parametrize("value", [b"hallo", {"a": [1, test_cid]}])
+def test_trusted_store_and_retrieve(value):
+    s = MappingCAStore(trusted=True)
+    cid = s.put(value)
+    assert s.get(cid) == value
+    assert cid == MappingCAStore().put(value)
+
+
+def test_collect_garbage_rejects_unknown_codecs():
+    s = MappingCAStore()
+    child = s.put(b"child")
+    root = s.put_raw(b"opaque", "dag-pb")
+    with pytest.raises(ValueError):
+        s.collect_garbage([root])
+    assert s.get(child) == b"child"
+    s.collect_garbage([])
+    assert child not in s
+
+
+def test_collect_garbage_validates_eagerly():
+    s = MappingCAStore()
+    with pytest.raises(TypeError):
+        s.iter_collect_garbage("notalist")
+    with pytest.raises(ValueError):
+        s.iter_collect_garbage([], batch_size=0)
+    steps = s.iter_collect_garbage([])
+    with pytest.raises(RuntimeError):
+        s.iter_collect_garbage([])
+    del steps
+    s.collect_garbage([])
+
+
+def test_import_cidv0_car():
+    data = b"\x0a\x02hi"
+    cid = CID("base58btc", 0, "dag-pb", ("sha2-256", hashlib.sha256(data).digest()))
+    header = dag_cbor.encode({"version": 1, "roots": [cid]})
+    block = bytes(cid) + data
+    car = varint.encode(len(header)) + header + varint.encode(len(block)) + block
+
+    s = MappingCAStore()
+    assert s.import_car(car) == [s.normalize_cid(cid)]
+    assert s.get_raw(cid) == data
+
+
+def test_collect_garbage_keeps_blocks_linked_by_concurrent_writes():
+    s = MappingCAStore()
+    old = s.put(b"old")
+    live = s.put(b"live")
+    root = s.put([live])
+
+    steps = s.iter_collect_garbage([root], batch_size=1)
+    next(steps)
+    new_root = s.put([old, live])
+    for _ in steps:
+        pass
+    assert s.get(new_root) == [old, live]
+    assert s.get(old) == b"old"
+
+
+def test_collect_garbage_reports_missing_roots():
+    s = MappingCAStore()
+    missing = MappingCAStore().put(b"elsewhere")
+    with pytest.raises(ValueError, match=str(missing)):
+        s.collect_garbage([missing])
+
+
+@pytest.mark.parametrize("base", ["base32", "base58btc"])
+def test_mapping_keys_are_cid_strings(base):
+    backend = {}
+    s = MappingCAStore(backend, default_base=base)
+    cid = s.put({"a": test_cid})
+    assert list(backend) == [str(s.normalize_cid(cid))]
+    assert s.get(cid.set(base="base58btc")) == {"a": test_cid}
@@ -0,0 +1,103 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import json
+import threading
+
+from ipldstore import IPFSStore, IPLDStore, MappingCAStore
+
+import pytest
+
+
+class MockIPFSHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = b""
+            while (size := int(self.rfile.readline().strip(), 16)) > 0:
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            self.rfile.readline()
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, self.headers["Content-Type"], body))
+        url = urlsplit(self.path)
+        if url.path != "/api/v0/dag/import" or parse_qs(url.query) != {"pin-roots": ["false"]}:
+            self.send_error(400)
+            return
+        response = b"".join(json.dumps(message).encode("utf-8") + b"\n"
+                            for message in self.server.responses)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mock_ipfs():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockIPFSHandler)
+    server.requests = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def extract_multipart_file(content_type, body):
+    boundary = content_type.split("boundary=")[1].encode("ascii")
+    part = body.split(b"--" + boundary)[1]
+    return part.split(b"\r\n\r\n", 1)[1][:-len(b"\r\n")]
+
+
+@pytest.mark.parametrize("as_chunks", [False, True])
+def test_import_car_single_request(mock_ipfs, as_chunks):
+    local = MappingCAStore()
+    root = local.put({"a": local.put(b"a"), "b": [local.put(b"b"), local.put(b"c")]})
+    car = local.to_car(root)
+
+    ipfs = IPFSStore(f"http://127.0.0.1:{mock_ipfs.server_address[1]}")
+    roots = ipfs.import_car(local.iter_car(root) if as_chunks else car)
+
+    assert roots == [root]
+    assert len(mock_ipfs.requests) == 1
+    path, content_type, body = mock_ipfs.requests[0]
+    url = urlsplit(path)
+    assert url.path == "/api/v0/dag/import"
+    assert parse_qs(url.query) == {"pin-roots": ["false"]}
+    assert extract_multipart_file(content_type, body) == car
+
+
+def test_import_car_reports_node_errors(mock_ipfs):
+    local = MappingCAStore()
+    root = local.put([local.put(b"a")])
+    mock_ipfs.responses = [{"Message": "block was not valid", "Code": 0, "Type": "error"}]
+
+    ipfs = IPFSStore(f"http://127.0.0.1:{mock_ipfs.server_address[1]}")
+    with pytest.raises(ValueError, match="block was not valid"):
+        ipfs.import_car(local.to_car(root))
+
+
+def test_push_ipldstore(mock_ipfs):
+    m = IPLDStore()
+    m[".zgroup"] = b'{"zarr_format": 2}'
+    m["a/0"] = b"chunk"
+
+    ipfs = IPFSStore(f"http://127.0.0.1:{mock_ipfs.server_address[1]}")
+    assert ipfs.import_car(m.iter_car()) == [m.freeze()]
+    assert len(mock_ipfs.requests) == 1
+    _, content_type, body = mock_ipfs.requests[0]
+    assert extract_multipart_file(content_type, body) == m.to_car()
+
+
+def test_sessions_are_per_thread():
+    ipfs = IPFSStore("http://127.0.0.1:1")
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(ipfs._session))
+    thread.start()
+    thread.join()
+    assert ipfs._session is ipfs._session
+    assert sessions[0] is not ipfs._session
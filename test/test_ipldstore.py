@@ -1,3 +1,6 @@
+import subprocess
+import sys
+
 from ipldstore import IPLDStore, MappingCAStore
 
 import pytest
@@ -25,3 +28,7 @@ def test_iterate_store_hierarchy():
     s["a/b"] = b"c"
     s["d"] = b"e"
     assert list(sorted(s)) == [".zgroup", "a/b", "d"]
+
+def test_import_does_not_load_requests():
+    code = "import sys, ipldstore; assert 'requests' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,140 @@
+import threading
+
+from ipldstore import IPLDStore, MappingCAStore, TieredCAStore
+
+import pytest
+
+
+class RecordingCAStore(MappingCAStore):
+    def __init__(self, failures=0):
+        super().__init__()
+        self.release = threading.Event()
+        self.release.set()
+        self.entered = threading.Event()
+        self.failures = failures
+        self.imported = []
+
+    def import_car(self, stream_or_bytes):
+        self.entered.set()
+        self.release.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("remote is down")
+        self.imported.append(stream_or_bytes)
+        return super().import_car(stream_or_bytes)
+
+
+def test_tiered_write_back():
+    remote = RecordingCAStore()
+    remote.release.clear()
+    with TieredCAStore(MappingCAStore(), remote) as s:
+        cid = s.put(b"hallo")
+        assert s.get(cid) == b"hallo"
+        assert cid not in remote
+        remote.release.set()
+        s.flush()
+        assert remote.get(cid) == b"hallo"
+
+
+def test_tiered_read_falls_through():
+    remote = MappingCAStore()
+    cid = remote.put(b"remote only")
+    with TieredCAStore(MappingCAStore(), remote) as s:
+        assert s.get(cid) == b"remote only"
+
+
+def test_tiered_freeze_flush():
+    remote = MappingCAStore()
+    with TieredCAStore(MappingCAStore(), remote, max_queue_size=2, batch_size=2) as s:
+        m = IPLDStore(s)
+        for i in range(10):
+            m[f"a/{i}"] = bytes([i])
+        root = m.freeze(flush=True)
+    m2 = IPLDStore(remote)
+    m2.set_root(root)
+    assert m2["a/5"] == bytes([5])
+
+
+def test_tiered_uploads_in_batches():
+    remote = RecordingCAStore()
+    remote.release.clear()
+    with TieredCAStore(MappingCAStore(), remote, batch_size=100) as s:
+        cids = [s.put(b"first")]
+        # the first batch is in flight, so the next ones are queued up
+        remote.entered.wait()
+        cids += [s.put(bytes([i])) for i in range(9)]
+        remote.release.set()
+        s.flush()
+    assert len(remote.imported) == 2
+    assert all(cid in remote for cid in cids)
+
+
+def test_tiered_skips_durable_blocks():
+    remote = RecordingCAStore()
+    with TieredCAStore(MappingCAStore(), remote) as s:
+        for _ in range(5):
+            s.put(b"hallo")
+            s.flush()
+    assert len(remote.imported) == 1
+
+
+def test_tiered_retries_failed_uploads():
+    remote = RecordingCAStore(failures=1)
+    with TieredCAStore(MappingCAStore(), remote) as s:
+        m = IPLDStore(s)
+        m["a/1"] = b"first"
+        with pytest.raises(RuntimeError):
+            m.freeze(flush=True)
+        m["a/2"] = b"second"
+        root = m.freeze(flush=True)
+    m2 = IPLDStore(remote)
+    m2.set_root(root)
+    assert m2["a/1"] == b"first"
+    assert m2["a/2"] == b"second"
+
+
+def test_tiered_keeps_raising_until_uploaded():
+    remote = RecordingCAStore(failures=2)
+    s = TieredCAStore(MappingCAStore(), remote)
+    cid = s.put(b"hallo")
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            s.flush()
+    s.close()
+    assert remote.get(cid) == b"hallo"
+
+
+def test_tiered_reports_hash_mismatch():
+    threads_before = threading.active_count()
+    s = TieredCAStore(MappingCAStore(), MappingCAStore(default_hash="sha2-512"))
+    s.put(b"hallo")
+    with pytest.raises(RuntimeError):
+        s.close()
+    assert threading.active_count() == threads_before
+
+
+def test_tiered_flush_uploads_reachable_local_blocks():
+    local = MappingCAStore()
+    m = IPLDStore(local)
+    m["a/1"] = b"written earlier"
+    root = m.freeze()
+
+    remote = MappingCAStore()
+    with TieredCAStore(local, remote) as s:
+        m = IPLDStore(s)
+        m.set_root(root)
+        m["a/2"] = b"new"
+        new_root = m.freeze(flush=True)
+    m2 = IPLDStore(remote)
+    m2.set_root(new_root)
+    assert m2["a/1"] == b"written earlier"
+    assert m2["a/2"] == b"new"
+
+
+def test_tiered_durable_cache_is_bounded():
+    remote = RecordingCAStore()
+    with TieredCAStore(MappingCAStore(), remote, durable_cache_size=1) as s:
+        for value in [b"a", b"b", b"a"]:
+            s.put(value)
+            s.flush()
+    assert len(remote.imported) == 3